@@ -11,15 +11,24 @@ This module provides a web interface to:
 3. View real-time console output
 """
 
+# gevent需要在导入其他模块之前完成猴子补丁
+import gevent
+from gevent import monkey
+monkey.patch_all()
+
 import os
 import sys
+import atexit
+import signal
 import configparser
+import hashlib
 import subprocess
-import threading
+import queue
 import logging
+import time
 from pathlib import Path
 from functools import wraps
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
+from flask import Flask, Response, render_template, jsonify, request, session, redirect, url_for
 from flask_socketio import SocketIO, emit
 from dotenv import load_dotenv
 import re
@@ -28,24 +37,122 @@ import re
 load_dotenv()
 
 # 配置日志
-logging.basicConfig(level=logging.DEBUG,
+# 默认只输出WARNING及以上级别，可通过环境变量LOG_LEVEL调整（如DEBUG）
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'WARNING').upper(),
                    format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 初始化Flask应用
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
-
 # 配置文件路径
 CONFIG_DIR = Path('config')
 MAIN_CONFIG = CONFIG_DIR / 'config.ini'
 URL_CONFIG = CONFIG_DIR / 'URL_config.ini'
+SECRET_KEY_FILE = CONFIG_DIR / '.secret_key'
+
+def load_secret_key():
+    """
+    获取会话密钥，优先使用环境变量SECRET_KEY，否则使用持久化到文件中的密钥，
+    使重启后已登录的会话依然有效
+    Returns:
+        会话密钥
+    """
+    secret_key = os.getenv('SECRET_KEY')
+    if secret_key:
+        return secret_key
+
+    try:
+        secret_key = SECRET_KEY_FILE.read_bytes()
+        if secret_key:
+            return secret_key
+        # 空文件说明上次写入未完成，删除后重新生成
+        SECRET_KEY_FILE.unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        # 密钥文件存在但无法读取（如权限不足），使用仅在本次运行有效的临时密钥
+        logger.warning(f"Failed to read secret key file, using a temporary key: {e}")
+        return os.urandom(32)
+
+    secret_key = os.urandom(32)
+    try:
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        # 创建时即指定0600权限，密钥文件任何时候都不会被其他用户读取
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(secret_key)
+    except FileExistsError:
+        # 其他进程已同时创建了密钥文件，使用其中的密钥
+        try:
+            return SECRET_KEY_FILE.read_bytes() or secret_key
+        except OSError as e:
+            logger.warning(f"Failed to read secret key file, using a temporary key: {e}")
+    except OSError as e:
+        logger.warning(f"Failed to persist secret key: {e}")
+    return secret_key
+
+# 初始化Flask应用
+app = Flask(__name__)
+app.config['SECRET_KEY'] = load_secret_key()
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='gevent')
+
+# 配置解析缓存: {路径: (st_ino, st_mtime_ns, st_size, 解析结果)}
+# 保存时通过os.replace替换文件，inode随之改变，即使mtime精度不足也能正确失效
+_CFG_CACHE = {}
+# 已确认存在的配置目录，避免每次保存都调用mkdir
+_DIR_READY = set()
+
+# 是否使用正则快速解析config.ini，无法识别的格式仍会回退到ConfigParser
+USE_FAST_INI_PARSER = True
+# 依次匹配: [section] 行、key = value 行、其他非空非注释行（需回退）
+# 键中不允许出现:，因为ConfigParser也把:当作分隔符，这类行交给ConfigParser解析
+_INI_LINE = re.compile(
+    r'^[ \t]*\[([^\]\n]+)\][ \t]*$'
+    r'|^([^=:;#\s][^=:\n]*?)[ \t]*=[ \t]*(.*?)[ \t]*$'
+    r'|^[ \t]*[^;#\s].*$',
+    re.M)
+
+# 日志批量推送参数：累计到指定行数或超过指定时间后一次性发送
+LOG_BATCH_SIZE = 128
+LOG_BATCH_INTERVAL = 0.05
+# 每次从管道读取的最大字节数
+LOG_READ_SIZE = 65536
+
+# ANSI转义序列匹配（字节形式，在解码前对整块输出执行）
+_ANSI_RE = re.compile(rb'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+# 预先生成的状态响应内容，避免每次请求都进行JSON编码
+_STATUS_BODY = {True: b'{"is_running":true}', False: b'{"is_running":false}'}
+_STATUS_PAYLOAD = {True: {'is_running': True}, False: {'is_running': False}}
+
+# 录制程序相关路径，在进程生命周期内保持不变
+_CWD = os.path.dirname(os.path.abspath(__file__))
+_MAIN_PY = os.path.join(_CWD, 'main.py')
+_VENV_DIR = os.path.join(_CWD, 'venv')
+_VENV_PY = os.path.join(_VENV_DIR, 'bin', 'python')
+_MAIN_OK = os.path.exists(_MAIN_PY)
+# 虚拟环境可能在启动后才由setup_virtual_environment创建，届时会更新该标记
+_VENV_OK = os.path.exists(_VENV_PY)
+
+# 录制程序的环境变量模板，启动时直接传给子进程，避免每次复制os.environ
+_BASE_ENV = dict(os.environ)
+_BASE_ENV['PYTHONPATH'] = _CWD  # 添加当前目录到Python路径
+if 'VIRTUAL_ENV' in _BASE_ENV:
+    _BASE_ENV['PATH'] = f"{os.path.join(_BASE_ENV['VIRTUAL_ENV'], 'bin')}:{_BASE_ENV['PATH']}"
+# start_recorder 显式使用项目虚拟环境
+_VENV_ENV = dict(os.environ)
+_VENV_ENV['PYTHONPATH'] = _CWD
+_VENV_ENV['VIRTUAL_ENV'] = _VENV_DIR
+_VENV_ENV['PATH'] = f"{os.path.join(_VENV_DIR, 'bin')}:{os.environ.get('PATH', '')}"
 
 # 全局变量
 recorder_process = None
 is_running = False
 log_monitor_thread = None
+# 最近一次广播的运行状态，仅在状态变化时才广播
+_last_status = None
+
+# 日志队列：读取任务只负责入队，由单独的推送任务批量发送到前端
+# SimpleQueue 不使用 queue.Queue 的条件变量与任务计数，入队出队开销更低
+_log_q = queue.SimpleQueue()
 
 def read_config(config_file):
     """
@@ -55,33 +162,80 @@ def read_config(config_file):
     Returns:
         配置内容的字典
     """
-    if not config_file.exists():
+    try:
+        st = config_file.stat()
+    except FileNotFoundError:
         return {}
 
+    # 文件未变化时直接返回上次解析的结果
+    cached = _CFG_CACHE.get(config_file)
+    if cached and cached[:3] == (st.st_ino, st.st_mtime_ns, st.st_size):
+        return cached[3]
+
     # 如果是URL配置文件，直接读取文本内容
     if config_file == URL_CONFIG:
         try:
             with open(config_file, 'r', encoding='utf-8-sig') as f:
                 content = f.read()
-            return {'content': content}
         except Exception as e:
             logger.error(f"Error reading URL config file: {e}")
             return {'content': ''}
+        result = {'content': content}
+        _CFG_CACHE[config_file] = (st.st_ino, st.st_mtime_ns, st.st_size, result)
+        return result
 
     # 主配置文件使用INI格式处理
-    config = configparser.ConfigParser(interpolation=None)
-    config.optionxform = str  # 保持键名的大小写
     try:
-        # 先尝试直接读取
-        config.read(config_file, encoding='utf-8')
-    except configparser.MissingSectionHeaderError:
-        # 如果失败，尝试处理BOM头
+        # utf-8-sig 会自动去除可能存在的BOM头
         with open(config_file, 'r', encoding='utf-8-sig') as f:
-            config.read_file(f)
+            text = f.read()
+        result = parse_ini_text(text) if USE_FAST_INI_PARSER else None
+        if result is None:
+            result = parse_ini_with_configparser(text)
     except Exception as e:
         logger.error(f"Error reading config file {config_file}: {e}")
         return {}
 
+    _CFG_CACHE[config_file] = (st.st_ino, st.st_mtime_ns, st.st_size, result)
+    return result
+
+def parse_ini_text(text):
+    """
+    使用正则一次性解析简单的INI文本（[section] 与 key = value 行）
+    Args:
+        text: INI文件内容
+    Returns:
+        配置内容的字典；遇到续行、DEFAULT节、重复的节或键等无法识别的内容时返回None
+    """
+    result = {}
+    values = None
+    for m in _INI_LINE.finditer(text):
+        section, key, value = m.group(1, 2, 3)
+        if section is not None:
+            # 重复的节交给ConfigParser处理（严格模式下会报错，与录制程序的读取结果一致）
+            if section == configparser.DEFAULTSECT or section in result:
+                return None
+            values = result[section] = {}
+        elif key is not None and values is not None:
+            if key in values:
+                return None
+            values[key] = value
+        else:
+            return None
+    return result
+
+def parse_ini_with_configparser(text):
+    """
+    使用ConfigParser解析INI文本
+    Args:
+        text: INI文件内容
+    Returns:
+        配置内容的字典
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str  # 保持键名的大小写
+    config.read_string(text)
+
     result = {}
     for section in config.sections():
         result[section] = {}
@@ -89,6 +243,27 @@ def read_config(config_file):
             result[section][key] = value
     return result
 
+def atomic_write_text(path, text):
+    """
+    原子方式写入文本文件：先写入同目录下的临时文件，再整体替换目标文件
+    Args:
+        path: 目标文件路径
+        text: 要写入的文本
+    """
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+
 def save_config(config_file, config_data):
     """
     保存配置文件
@@ -99,8 +274,10 @@ def save_config(config_file, config_data):
     try:
         # 确保配置目录存在
         config_dir = config_file.parent
-        config_dir.mkdir(parents=True, exist_ok=True)
-        logger.info(f"Ensuring config directory exists: {config_dir}")
+        if config_dir not in _DIR_READY:
+            config_dir.mkdir(parents=True, exist_ok=True)
+            logger.info("Ensuring config directory exists: %s", config_dir)
+            _DIR_READY.add(config_dir)
         
         # 如果是URL配置文件，直接保存文本内容
         if config_file == URL_CONFIG:
@@ -109,9 +286,9 @@ def save_config(config_file, config_data):
                 if not isinstance(content, str):
                     content = ''  # 如果内容不是字符串类型，设置为空字符串
                     
-                logger.info(f"Saving URL config to: {config_file}")
-                with open(config_file, 'w', encoding='utf-8') as f:
-                    f.write(content)
+                logger.info("Saving URL config to: %s", config_file)
+                atomic_write_text(config_file, content)
+                _CFG_CACHE.pop(config_file, None)
                 logger.info("URL config saved successfully")
                 return
                 
@@ -120,21 +297,20 @@ def save_config(config_file, config_data):
                 logger.error(error_msg, exc_info=True)
                 raise ValueError(error_msg)
 
-        # 主配置文件使用INI格式保存
-        config = configparser.ConfigParser(interpolation=None)
-        config.optionxform = str  # 保持键名的大小写
-        
-        # 添加所有配置节
+        # 主配置文件使用INI格式保存，直接拼接文本，输出格式与ConfigParser.write一致
+        parts = []
         for section, values in config_data.items():
-            if not config.has_section(section):
-                config.add_section(section)
+            parts.append(f"[{section}]")
             for key, value in values.items():
-                config.set(section, key, str(value))
+                # 多行值使用缩进续行，保证能被ConfigParser正确读回
+                value = str(value).replace('\n', '\n\t')
+                parts.append(f"{key} = {value}")
+            parts.append("")
         
         # 保存到文件
-        logger.info(f"Saving main config to: {config_file}")
-        with open(config_file, 'w', encoding='utf-8') as f:
-            config.write(f)
+        logger.info("Saving main config to: %s", config_file)
+        atomic_write_text(config_file, "\n".join(parts) + "\n" if parts else "")
+        _CFG_CACHE.pop(config_file, None)
         logger.info("Main config saved successfully")
         
     except Exception as e:
@@ -230,54 +406,44 @@ def control_recorder(action):
     """
     global recorder_process, is_running, log_monitor_thread
 
-    logger.info(f"Received control action: {action}")
+    logger.info("Received control action: %s", action)
 
     if action == 'start' and not is_running:
         try:
             # 检查main.py是否存在
-            cwd = os.path.dirname(os.path.abspath(__file__))
-            main_py = os.path.join(cwd, 'main.py')
-            if not os.path.exists(main_py):
+            if not _MAIN_OK:
                 raise FileNotFoundError("main.py not found")
 
             # 使用虚拟环境的Python解释器
-            venv_python = os.path.join(cwd, 'venv', 'bin', 'python')
-            if not os.path.exists(venv_python):
+            if not _VENV_OK:
                 raise FileNotFoundError("Virtual environment Python interpreter not found")
             
-            logger.info(f"Using Python interpreter: {venv_python}")
-            logger.info(f"Current working directory: {cwd}")
-
-            # 设置环境变量
-            env = os.environ.copy()
-            env['PYTHONPATH'] = cwd  # 添加当前目录到Python路径
-            if 'VIRTUAL_ENV' in env:
-                env['PATH'] = f"{os.path.join(env['VIRTUAL_ENV'], 'bin')}:{env['PATH']}"
-            
+            logger.info("Using Python interpreter: %s", _VENV_PY)
+            logger.info("Current working directory: %s", _CWD)
+
             # 启动录制程序，确保不使用缓冲
-            cmd = [venv_python, '-u', main_py]  # 添加 -u 参数禁用输出缓冲
-            logger.info(f"Starting process with command: {cmd}")
+            cmd = [_VENV_PY, '-u', _MAIN_PY]  # 添加 -u 参数禁用输出缓冲
+            logger.info("Starting process with command: %s", cmd)
             
             recorder_process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1,  # Line buffering
-                env=env,
-                cwd=cwd
+                bufsize=LOG_READ_SIZE,  # 二进制管道，由日志读取任务按块读取并解码
+                env=_BASE_ENV,
+                cwd=_CWD,
+                start_new_session=True,  # 独立进程组，停止时可一并终止其子进程
+                close_fds=True
             )
             
-            logger.info(f"Process started with PID: {recorder_process.pid}")
+            logger.info("Process started with PID: %s", recorder_process.pid)
             is_running = True
             
-            # 启动日志监控线程
-            log_monitor_thread = threading.Thread(target=monitor_output, args=(recorder_process,))
-            log_monitor_thread.daemon = True
-            log_monitor_thread.start()
+            # 启动日志监控任务
+            log_monitor_thread = socketio.start_background_task(monitor_output, recorder_process)
             
             # 发送初始状态
-            socketio.emit('status', {'is_running': True})
+            emit_status(True)
             socketio.emit('log', {'data': f'程序已启动 (PID: {recorder_process.pid})'})
             
             return jsonify({'status': 'success', 'message': '程序已启动'})
@@ -291,8 +457,7 @@ def control_recorder(action):
     elif action == 'stop' and is_running:
         try:
             logger.info("Stopping recorder process")
-            recorder_process.terminate()
-            recorder_process.wait(timeout=5)
+            terminate_recorder(recorder_process)
             is_running = False
             logger.info("Recorder process stopped")
             return jsonify({'status': 'success', 'message': '录制程序已停止'})
@@ -302,32 +467,78 @@ def control_recorder(action):
 
     return jsonify({'status': 'error', 'message': '无效的操作'}), 400
 
+def terminate_recorder(process, timeout=5):
+    """
+    终止录制程序所在的整个进程组（包括其启动的ffmpeg等子进程）
+    Args:
+        process: 录制程序进程
+        timeout: 等待进程退出的秒数，超时后强制结束
+    """
+    # 录制程序以start_new_session启动，进程组ID即为其PID；
+    # 即使录制程序本身已退出，仍可终止残留在该进程组中的子进程
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        # 进程组中已没有进程
+        return
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+@atexit.register
+def cleanup_recorder():
+    """退出时终止仍在运行的录制程序，录制程序在独立进程组中不会收到终端的Ctrl+C"""
+    if recorder_process and recorder_process.poll() is None:
+        terminate_recorder(recorder_process)
+
+def handle_exit_signal(signum):
+    """
+    收到SIGTERM/SIGHUP（如关闭终端）时先终止录制程序，再按默认方式退出；
+    atexit只在解释器正常退出时执行，不能覆盖这两种信号
+    Args:
+        signum: 信号编号
+    """
+    cleanup_recorder()
+    # 恢复默认处理后重新发送信号，使进程以该信号的默认行为退出，不依赖当前所在的协程
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
 @app.route('/api/status')
 @login_required
 def get_status():
     """获取录制程序状态"""
-    return jsonify({
-        'is_running': is_running
-    })
+    # 每次请求新建Response，避免会话Cookie等头信息在请求之间共享
+    return Response(_STATUS_BODY[is_running], mimetype='application/json')
+
+def emit_status(running):
+    """
+    向所有客户端广播运行状态，状态未变化时不重复发送
+    Args:
+        running: 是否正在运行
+    """
+    global _last_status
+    if running is not _last_status:
+        _last_status = running
+        socketio.emit('status', _STATUS_PAYLOAD[running])
 
 @socketio.on('connect')
 def handle_connect():
     """处理WebSocket连接"""
     if not session.get('authenticated'):
         return False
-    emit('status', {'is_running': is_running})
+    emit('status', _STATUS_PAYLOAD[is_running])
 
-def clean_ansi_escape_sequences(text):
+def clean_ansi_escape_sequences(data):
     """
-    清理文本中的ANSI转义序列
+    清理字节数据中的ANSI转义序列
     Args:
-        text: 原始文本
+        data: 原始字节数据
     Returns:
-        清理后的文本
+        清理后的字节数据
     """
-    # 匹配所有ANSI转义序列
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
+    return _ANSI_RE.sub(b'', data)
 
 def monitor_output(process):
     """
@@ -337,37 +548,49 @@ def monitor_output(process):
     """
     global is_running
     logger.info("Starting output monitor")
-    
+
+    def append_line(raw):
+        cleaned_line = raw.decode('utf-8', errors='replace').strip()
+        if cleaned_line:  # 确保不是空行
+            logger.info("Process output: %s", cleaned_line)
+            _log_q.put(cleaned_line)
+
     try:
         # 发送初始状态
-        socketio.emit('status', {'is_running': True})
-        socketio.emit('log', {'data': '程序启动中...'})
-        
-        # 使用迭代器读取输出，这样可以实时获取输出
-        for line in iter(process.stdout.readline, ''):
-            if line:
-                # 清理ANSI转义序列
-                cleaned_line = clean_ansi_escape_sequences(line.strip())
-                if cleaned_line:  # 确保不是空行
-                    logger.info(f"Process output: {cleaned_line}")
-                    # 使用 emit 发送日志到前端
-                    socketio.emit('log', {'data': cleaned_line})
-            
-            # 检查进程是否已经结束
-            if process.poll() is not None:
+        emit_status(True)
+        _log_q.put('程序启动中...')
+
+        # read1 阻塞到有数据可读，然后一次性返回当前可读的全部数据（最多一次底层read）
+        tail = b''
+        while True:
+            chunk = process.stdout.read1(LOG_READ_SIZE)
+            if not chunk:
+                # 管道已关闭，处理最后不完整的一行
+                if tail:
+                    append_line(clean_ansi_escape_sequences(tail))
                 logger.info("Process ended")
                 break
+            data = tail + chunk
+            # 与文本模式管道一致，\r、\n、\r\n 都视为换行（录制程序用 \r 刷新状态行）
+            pos = max(data.rfind(b'\n'), data.rfind(b'\r'))
+            if pos < 0:
+                tail = data
+            else:
+                tail = data[pos + 1:]
+                # 对整块完整行执行一次ANSI清理，再按行拆分
+                for raw in clean_ansi_escape_sequences(data[:pos]).splitlines():
+                    append_line(raw)
                 
     except Exception as e:
         error_msg = f"Error monitoring output: {str(e)}"
         logger.error(error_msg, exc_info=True)
-        socketio.emit('log', {'data': f"错误: {error_msg}"})
+        _log_q.put(f"错误: {error_msg}")
     finally:
         # 进程结束，更新状态
         is_running = False
         logger.info("Process status updated to stopped")
-        socketio.emit('status', {'is_running': False})
-        socketio.emit('log', {'data': '程序已停止'})
+        emit_status(False)
+        _log_q.put('程序已停止')
         
         # 确保关闭所有管道
         try:
@@ -375,52 +598,63 @@ def monitor_output(process):
         except:
             pass
 
+def emit_logs():
+    """
+    批量推送日志的后台任务
+    从日志队列中取出日志，累计到指定行数或到达截止时间后一次性发送
+    """
+    while True:
+        batch = [_log_q.get()]
+        deadline = time.monotonic() + LOG_BATCH_INTERVAL
+        while len(batch) < LOG_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_log_q.get(timeout=timeout))
+            except queue.Empty:
+                break
+        socketio.emit('log_batch', {'lines': batch})
+
+# 日志推送任务在应用初始化时启动一次
+log_emitter_task = socketio.start_background_task(emit_logs)
+
 def start_recorder():
     global recorder_process, log_monitor_thread, is_running
     try:
         if recorder_process and recorder_process.poll() is None:
             return {'status': 'error', 'message': '程序已经在运行中'}
 
-        # 获取当前工作目录
-        cwd = os.path.dirname(os.path.abspath(__file__))
-        main_py = os.path.join(cwd, 'main.py')
-        if not os.path.exists(main_py):
+        # 检查main.py是否存在
+        if not _MAIN_OK:
             return {'status': 'error', 'message': '找不到 main.py 文件'}
 
         # 使用虚拟环境的Python解释器
-        venv_python = os.path.join(cwd, 'venv', 'bin', 'python')
-        if not os.path.exists(venv_python):
+        if not _VENV_OK:
             return {'status': 'error', 'message': '找不到虚拟环境Python解释器'}
 
-        # 设置环境变量
-        env = os.environ.copy()
-        env['PYTHONPATH'] = cwd  # 添加当前目录到Python路径
-        env['VIRTUAL_ENV'] = os.path.join(cwd, 'venv')
-        env['PATH'] = f"{os.path.join(env['VIRTUAL_ENV'], 'bin')}:{env.get('PATH', '')}"
-
         # 启动进程
-        cmd = [venv_python, '-u', main_py]  # 添加 -u 参数禁用输出缓冲
-        logger.info(f'Starting recorder with command: {cmd}')
-        logger.info(f'Working directory: {cwd}')
-        logger.info(f'Environment: PYTHONPATH={env.get("PYTHONPATH")}, PATH={env.get("PATH")}')
+        cmd = [_VENV_PY, '-u', _MAIN_PY]  # 添加 -u 参数禁用输出缓冲
+        logger.info('Starting recorder with command: %s', cmd)
+        logger.info('Working directory: %s', _CWD)
+        logger.info('Environment: PYTHONPATH=%s, PATH=%s', _VENV_ENV["PYTHONPATH"], _VENV_ENV["PATH"])
         
         recorder_process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            cwd=cwd,
-            env=env,
-            universal_newlines=True,
-            bufsize=1
+            cwd=_CWD,
+            env=_VENV_ENV,
+            bufsize=LOG_READ_SIZE,  # 二进制管道，由日志读取任务按块读取并解码
+            start_new_session=True,  # 独立进程组，停止时可一并终止其子进程
+            close_fds=True
         )
 
-        logger.info(f"Process started with PID: {recorder_process.pid}")
+        logger.info("Process started with PID: %s", recorder_process.pid)
         is_running = True
 
-        # 启动日志监控线程
-        log_monitor_thread = threading.Thread(target=monitor_output, args=(recorder_process,))
-        log_monitor_thread.daemon = True
-        log_monitor_thread.start()
+        # 启动日志监控任务
+        log_monitor_thread = socketio.start_background_task(monitor_output, recorder_process)
 
         return {'status': 'success', 'message': '程序已启动'}
     except Exception as e:
@@ -431,19 +665,13 @@ def start_recorder():
 def setup_virtual_environment():
     """
     设置虚拟环境并安装依赖
+    requirements.txt 未变化时跳过依赖安装
     Returns:
         bool: 是否成功设置虚拟环境
     """
+    global _VENV_OK
     try:
-        cwd = os.path.dirname(os.path.abspath(__file__))
-        venv_path = os.path.join(cwd, 'venv')
-        
-        # 检查虚拟环境是否已存在
-        if not os.path.exists(venv_path):
-            logger.info("Creating virtual environment...")
-            import venv
-            venv.create(venv_path, with_pip=True)
-            logger.info("Virtual environment created successfully")
+        venv_path = _VENV_DIR
         
         # 获取虚拟环境的Python和pip路径
         if sys.platform == 'win32':
@@ -453,17 +681,37 @@ def setup_virtual_environment():
             venv_python = os.path.join(venv_path, 'bin', 'python')
             venv_pip = os.path.join(venv_path, 'bin', 'pip')
         
+        # 检查虚拟环境是否已存在
+        if not os.path.exists(venv_python):
+            logger.info("Creating virtual environment...")
+            import venv
+            venv.create(venv_path, with_pip=True)
+            logger.info("Virtual environment created successfully")
+        
         # 检查requirements.txt是否存在
-        requirements_file = os.path.join(cwd, 'requirements.txt')
+        requirements_file = os.path.join(_CWD, 'requirements.txt')
         if not os.path.exists(requirements_file):
             logger.error("requirements.txt not found")
             return False
         
-        # 安装依赖
-        logger.info("Installing dependencies...")
-        subprocess.run([venv_pip, 'install', '-r', requirements_file], check=True)
-        logger.info("Dependencies installed successfully")
+        # 根据requirements.txt的哈希判断依赖是否需要重新安装
+        req_hash = hashlib.blake2b(Path(requirements_file).read_bytes(), digest_size=16).hexdigest()
+        req_hash_file = Path(venv_path) / '.req_hash'
+        try:
+            installed_hash = req_hash_file.read_text(encoding='utf-8').strip()
+        except FileNotFoundError:
+            installed_hash = None
         
+        if installed_hash == req_hash:
+            logger.info("Dependencies are up to date, skipping installation")
+        else:
+            # 安装依赖
+            logger.info("Installing dependencies...")
+            subprocess.run([venv_pip, 'install', '-r', requirements_file], check=True)
+            req_hash_file.write_text(req_hash, encoding='utf-8')
+            logger.info("Dependencies installed successfully")
+        
+        _VENV_OK = os.path.exists(_VENV_PY)
         return True
     except Exception as e:
         logger.error(f"Error setting up virtual environment: {str(e)}", exc_info=True)
@@ -477,4 +725,9 @@ if __name__ == '__main__':
         logger.error("Failed to setup virtual environment. Exiting...")
         sys.exit(1)
     
-    socketio.run(app, debug=True, host='0.0.0.0', port=5678) 
\ No newline at end of file
+    # 录制程序在独立会话中运行，收不到终端的信号，由本进程在退出前终止它
+    # 使用gevent的信号处理，回调在独立协程中运行，可以等待录制程序退出
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        gevent.signal_handler(signum, handle_exit_signal, signum)
+    
+    socketio.run(app, host='0.0.0.0', port=5678)
\ No newline at end of file
@@ -10,144 +10,543 @@
 """
 
 import os
+import base64
 import json
+import secrets
+import socket
+import sqlite3
 import subprocess
+import tempfile
+import threading
+import time
 import logging
+import queue
+import urllib.error
+import urllib.request
 from datetime import datetime
-from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener
 
-# 配置日志
+# 配置日志：日志记录先放入队列，由后台线程写入文件和终端，避免扫描线程被日志I/O阻塞
+_log_queue = queue.Queue(-1)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('ts_monitor.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(_log_queue)]
+)
+_log_listener = QueueListener(
+    _log_queue,
+    logging.FileHandler('ts_monitor.log'),
+    logging.StreamHandler(),
+)
+
+# 缓存数据库路径
+CACHE_DB = 'ts_monitor_cache.db'
+
+# 扫描根目录（当前工作目录）及其路径前缀，用于计算相对路径
+CWD = os.getcwd()
+CWD_PREFIX = CWD.rstrip(os.sep) + os.sep
+
+# 扫描时跳过的目录名（以逗号分隔，可通过环境变量覆盖）；以.开头的隐藏目录也总是跳过
+PRUNE = frozenset(
+    name.strip()
+    for name in os.environ.get(
+        "TS_MONITOR_PRUNE", ".git,__pycache__,node_modules,.venv,venv,.cache"
+    ).split(",")
+    if name.strip()
 )
 
-# 缓存文件路径
-CACHE_FILE = Path('ts_monitor_cache.json')
+# 同时进行的云端移动任务数（至少为1，否则没有线程消费上传队列）
+CONCURRENCY = max(1, int(os.environ.get("TS_MONITOR_CONCURRENCY", "8")))
+# 待移动文件队列的容量，队列满时扫描会等待上传线程
+UPLOAD_QUEUE_SIZE = 128
 
-def load_file_cache():
+# rclone 远程控制守护进程的监听地址；未设置时每次运行自动选择一个空闲端口，
+# 避免与仍在运行的上一次任务共用同一个守护进程
+RC_ADDR = os.environ.get("TS_MONITOR_RC_ADDR")
+# 等待守护进程就绪的最长时间（秒）
+RC_STARTUP_TIMEOUT = 15
+
+# 访问本地守护进程时不使用系统代理
+_rc_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+# 本次运行实际使用的守护进程地址，由 start_rclone_daemon 设置
+_rc_addr = RC_ADDR
+
+def open_cache_db():
     """
-    加载文件大小缓存
-    返回: 包含文件大小信息的字典
+    打开缓存数据库，不存在时自动创建
+    返回: sqlite3 连接
     """
-    if CACHE_FILE.exists():
-        try:
-            with open(CACHE_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            logging.warning("缓存文件损坏，创建新的缓存")
-    return {}
+    conn = sqlite3.connect(CACHE_DB)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # 以 (设备号, inode) 作为主键，文件被重命名或移动后缓存依然有效
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS seen("
+        "dev INTEGER, ino INTEGER, size INTEGER, mtime REAL, PRIMARY KEY(dev, ino))"
+    )
+    # 已成功上传的文件，用于避免重复上传仍残留在本地的文件
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS uploaded("
+        "dev INTEGER, ino INTEGER, size INTEGER, mtime REAL, PRIMARY KEY(dev, ino))"
+    )
+    # 记录每个目录上次扫描时的修改时间、.ts文件数与子目录名（以/分隔）
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS dirs("
+        "path TEXT PRIMARY KEY, mtime_ns INTEGER, ts_count INTEGER, subdirs TEXT)"
+    )
+    return conn
+
+def load_file_cache(conn, table="seen"):
+    """
+    加载文件缓存
+    参数:
+        conn: 缓存数据库连接
+        table: 表名，seen 为文件大小缓存，uploaded 为已上传文件记录
+    返回: {(dev, ino): (size, mtime)} 字典
+    """
+    return {(dev, ino): (size, mtime) for dev, ino, size, mtime in conn.execute(f"SELECT dev, ino, size, mtime FROM {table}")}
+
+def save_file_cache(conn, old_cache, cache, table="seen"):
+    """
+    保存文件缓存，只写入发生变化的记录，并在一个事务中完成
+    参数:
+        conn: 缓存数据库连接
+        old_cache: 扫描前加载的缓存
+        cache: 扫描后的缓存
+        table: 表名，seen 为文件大小缓存，uploaded 为已上传文件记录
+    """
+    upserts = [(dev, ino, size, mtime) for (dev, ino), (size, mtime) in cache.items()
+               if old_cache.get((dev, ino)) != (size, mtime)]
+    deletes = [key for key in old_cache if key not in cache]
+    if not upserts and not deletes:
+        return
+    with conn:
+        conn.executemany(
+            f"INSERT INTO {table}(dev, ino, size, mtime) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(dev, ino) DO UPDATE SET size = excluded.size, mtime = excluded.mtime",
+            upserts,
+        )
+        conn.executemany(f"DELETE FROM {table} WHERE dev = ? AND ino = ?", deletes)
+
+def load_dir_cache(conn):
+    """
+    加载目录缓存
+    参数:
+        conn: 缓存数据库连接
+    返回: {目录路径: (mtime_ns, ts_count, 子目录名元组)} 字典
+    """
+    return {
+        path: (mtime_ns, ts_count, tuple(subdirs.split("/")) if subdirs else ())
+        for path, mtime_ns, ts_count, subdirs in conn.execute("SELECT path, mtime_ns, ts_count, subdirs FROM dirs")
+    }
 
-def save_file_cache(cache):
+def save_dir_cache(conn, old_cache, cache):
     """
-    保存文件大小缓存
+    保存目录缓存，只写入发生变化的记录，并删除本次未遍历到的目录
     参数:
-        cache: 包含文件大小信息的字典
+        conn: 缓存数据库连接
+        old_cache: 扫描前加载的目录缓存
+        cache: 本次扫描得到的目录缓存
     """
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(cache, f, indent=4)
+    upserts = [(path, mtime_ns, ts_count, "/".join(subdirs))
+               for path, (mtime_ns, ts_count, subdirs) in cache.items()
+               if old_cache.get(path) != (mtime_ns, ts_count, subdirs)]
+    deletes = [(path,) for path in old_cache if path not in cache]
+    if not upserts and not deletes:
+        return
+    with conn:
+        conn.executemany(
+            "INSERT INTO dirs(path, mtime_ns, ts_count, subdirs) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns, "
+            "ts_count = excluded.ts_count, subdirs = excluded.subdirs",
+            upserts,
+        )
+        conn.executemany("DELETE FROM dirs WHERE path = ?", deletes)
 
-def get_ts_files(directory):
+def get_target_path(directory):
     """
-    获取指定目录下所有的.ts文件
+    获取目录对应的云端目标路径，保持目录结构
     参数:
-        directory: 要扫描的目录路径
-    返回: 按修改时间排序的.ts文件列表
+        directory: 本地目录路径字符串
+    返回: 云端目标路径
     """
-    # 使用Path对象获取目录下所有.ts文件
-    ts_files = list(Path(directory).glob("*.ts"))
-    # 按修改时间排序，最新的在前面
-    ts_files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-    return ts_files
+    # 扫描得到的目录都位于CWD之下，直接截取前缀即可得到相对路径
+    if directory.startswith(CWD_PREFIX):
+        relative_path = directory[len(CWD_PREFIX):]
+    elif directory == CWD:
+        relative_path = ""
+    else:
+        relative_path = os.path.relpath(directory, CWD)
+    return "od-chan:youtube-dl/" + relative_path
 
-def move_file_to_cloud(file_path):
+def rc_call(command, params=None, timeout=None):
     """
-    使用rclone将文件移动到云端
+    调用 rclone 守护进程的远程控制接口
     参数:
-        file_path: 需要移动的文件路径
+        command: 接口名称，如 operations/movefile
+        params: 接口参数字典
+        timeout: 请求超时时间（秒）
+    返回: 接口返回的JSON对象
+    异常:
+        RuntimeError: 接口返回错误时抛出，包含rclone给出的错误信息
     """
+    request = urllib.request.Request(
+        f"http://{_rc_addr}/{command}",
+        data=json.dumps(params or {}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
     try:
-        # 构造云端目标路径，保持目录结构
-        relative_path = os.path.relpath(str(file_path), str(Path.cwd()))
-        target_path = f"od-chan:youtube-dl/{os.path.dirname(relative_path)}"
-        
-        # 创建目标目录（如果不存在）
-        mkdir_cmd = f"rclone mkdir {target_path}"
-        subprocess.run(mkdir_cmd, shell=True, check=True)
+        with _rc_opener.open(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.load(e).get("error", str(e))
+        except ValueError:
+            message = str(e)
+        raise RuntimeError(message) from None
+
+def pick_rc_addr():
+    """
+    选择一个本机空闲端口作为守护进程的监听地址
+    返回: "127.0.0.1:端口" 形式的地址
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+def start_rclone_daemon():
+    """
+    启动 rclone 远程控制守护进程，并等待其可以接受请求
+    所有移动操作复用同一个rclone进程及其云端会话，避免每次调用都重新启动rclone
+    返回: 守护进程对象，启动失败时返回None
+    """
+    global _rc_addr
+    _rc_addr = RC_ADDR or pick_rc_addr()
+    
+    # 每次运行生成随机的用户名和密码，防止本机其他进程通过远程控制接口操作云端；
+    # 通过环境变量传给rclone，避免出现在进程命令行中
+    rc_user = secrets.token_urlsafe(16)
+    rc_pass = secrets.token_urlsafe(32)
+    credentials = base64.b64encode(f"{rc_user}:{rc_pass}".encode("utf-8")).decode("ascii")
+    _rc_opener.addheaders = [("Authorization", f"Basic {credentials}")]
+    env = dict(os.environ, RCLONE_RC_USER=rc_user, RCLONE_RC_PASS=rc_pass)
+    
+    # 标准输出丢弃；标准错误写入临时文件而不是管道，避免无人读取时管道写满阻塞rclone，
+    # 启动失败时再从中读取错误信息
+    with tempfile.TemporaryFile() as stderr_file:
+        try:
+            daemon = subprocess.Popen(
+                ["rclone", "rcd", f"--rc-addr={_rc_addr}"],
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=stderr_file,
+            )
+        except OSError as e:
+            logging.error(f"无法启动 rclone 守护进程: {str(e)}")
+            return None
         
-        # 移动文件
-        move_cmd = f"rclone move {file_path} {target_path}"
-        subprocess.run(move_cmd, shell=True, check=True)
-        logging.info(f"成功移动文件 {file_path} 到 {target_path}")
+        deadline = time.monotonic() + RC_STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if daemon.poll() is not None:
+                stderr_file.seek(0)
+                message = stderr_file.read().decode("utf-8", errors="replace").strip()
+                logging.error(f"rclone 守护进程启动失败，退出码 {daemon.returncode}: {message}")
+                return None
+            try:
+                rc_call("rc/noop", timeout=1)
+            except (OSError, RuntimeError):
+                time.sleep(0.1)
+                continue
+            
+            # 应答可能来自占用同一地址的其他守护进程，确认其进程号与本次启动的一致
+            try:
+                pid = rc_call("core/pid", timeout=1).get("pid")
+            except (OSError, RuntimeError, ValueError):
+                pid = None
+            if pid == daemon.pid and daemon.poll() is None:
+                return daemon
+            stop_rclone_daemon(daemon)
+            stderr_file.seek(0)
+            message = stderr_file.read().decode("utf-8", errors="replace").strip()
+            logging.error(f"rclone 守护进程启动失败，{_rc_addr} 上应答的进程 {pid} 不是本次启动的进程 {daemon.pid}: {message}")
+            return None
+        logging.error("等待 rclone 守护进程就绪超时")
+        stop_rclone_daemon(daemon)
+        return None
+
+def stop_rclone_daemon(daemon):
+    """
+    停止 rclone 远程控制守护进程
+    参数:
+        daemon: 守护进程对象
+    """
+    daemon.terminate()
+    try:
+        daemon.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        daemon.kill()
+        daemon.wait()
+
+def move_file_to_cloud(directory, name, target_path, size):
+    """
+    通过 rclone 守护进程将文件移动到云端
+    参数:
+        directory: 文件所在的本地目录
+        name: 文件名
+        target_path: 云端目标路径
+        size: 文件大小（字节），仅用于日志
+    返回: 是否移动成功
+    """
+    try:
+        # 移动时会自动创建目标目录
+        rc_call("operations/movefile", {
+            "srcFs": directory,
+            "srcRemote": name,
+            "dstFs": target_path,
+            "dstRemote": name,
+        })
+        logging.info(f"成功移动文件 {os.path.join(directory, name)} ({size} 字节) 到 {target_path}")
         return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"移动文件 {file_path} 失败: {str(e)}")
+    except (OSError, RuntimeError) as e:
+        logging.error(f"移动文件 {os.path.join(directory, name)} 失败: {str(e)}")
         return False
 
-def process_directory(directory, file_cache):
+def scan_directories(root, dir_cache, new_dir_cache):
     """
-    处理指定目录中的.ts文件
+    遍历根目录及其所有子目录，每个目录只调用一次 os.scandir
+    目录的修改时间只在增删、重命名条目时改变，因此上次没有.ts文件且修改时间未变的目录
+    无需重新读取，直接沿用缓存的子目录列表；含有.ts文件的目录仍需重新扫描以获取文件大小
+    名称在 PRUNE 中或以.开头的子目录不会进入，但仍记录在目录缓存中，修改 PRUNE 后可立即生效
+    参数:
+        root: 根目录路径
+        dir_cache: 上次扫描的目录缓存
+        new_dir_cache: 用于记录本次扫描结果的目录缓存
+    返回: 生成器，逐个返回 (目录路径, 该目录下的.ts文件DirEntry列表)
+    """
+    # 修改时间距扫描开始过近的目录不写入缓存，避免同一时间精度内的后续修改被漏掉
+    trusted_before_ns = time.time_ns() - 1_000_000_000
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError as e:
+            logging.warning(f"无法读取目录 {directory}: {str(e)}")
+            continue
+        
+        cached = dir_cache.get(directory)
+        if cached is not None and cached[0] == mtime_ns and cached[1] == 0:
+            new_dir_cache[directory] = cached
+            stack.extend(os.path.join(directory, name) for name in cached[2]
+                         if name not in PRUNE and not name.startswith("."))
+            continue
+        
+        ts_entries = []
+        subdirs = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    # 目录项类型来自readdir，不需要额外的stat调用
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        if entry.name not in PRUNE and not entry.name.startswith("."):
+                            stack.append(entry.path)
+                    elif entry.name.endswith(".ts") and entry.is_file(follow_symlinks=False):
+                        ts_entries.append(entry)
+        except OSError as e:
+            logging.warning(f"无法读取目录 {directory}: {str(e)}")
+            continue
+        
+        new_dir_cache[directory] = (mtime_ns if mtime_ns < trusted_before_ns else -1,
+                                    len(ts_entries), tuple(subdirs))
+        yield directory, ts_entries
+
+def process_directory(directory, ts_entries, file_cache, uploaded, new_uploaded, to_move):
+    """
+    处理指定目录中的.ts文件，将需要移动的文件加入待移动列表
     参数:
         directory: 要处理的目录路径
-        file_cache: 文件大小缓存字典
+        ts_entries: 该目录下.ts文件的DirEntry列表
+        file_cache: 文件大小缓存字典，键为 (dev, ino)
+        uploaded: 上次运行记录的已上传文件 {(dev, ino): (size, mtime)}
+        new_uploaded: 本次仍需保留的已上传文件记录
+        to_move: 待移动文件列表，元素为 (所在目录, 文件名, 云端目标路径, stat结果)
     """
-    # 获取当前目录下的.ts文件
-    ts_files = get_ts_files(directory)
-    
-    if not ts_files:
+    if not ts_entries:
         return
     
-    if len(ts_files) > 1:
-        logging.info(f"目录 {directory} 中发现{len(ts_files)}个.ts文件，开始处理")
+    # 跳过已成功上传但仍残留在本地的文件；同时比较大小与修改时间，
+    # 避免inode被新文件复用时误判
+    if uploaded:
+        remaining = []
+        for entry in ts_entries:
+            st = entry.stat()
+            key = (st.st_dev, st.st_ino)
+            if uploaded.get(key) == (st.st_size, st.st_mtime):
+                logging.info(f"文件 {entry.path} 已上传过，跳过")
+                new_uploaded[key] = uploaded[key]
+            else:
+                remaining.append(entry)
+        ts_entries = remaining
+        if not ts_entries:
+            return
+    
+    # 按修改时间排序，最新的在前面；DirEntry会缓存stat结果，后续读取大小不再调用stat
+    ts_entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    target_path = get_target_path(directory)
+    
+    if len(ts_entries) > 1:
+        logging.info(f"目录 {directory} 中发现{len(ts_entries)}个.ts文件，开始处理")
         
         # 保留最新的文件，移动其他文件
-        for file in ts_files[1:]:
-            if move_file_to_cloud(file):
-                file_cache.pop(str(file), None)  # 从缓存中移除已移动的文件
+        for entry in ts_entries[1:]:
+            to_move.append((directory, entry.name, target_path, entry.stat()))
     else:
         # 只有一个文件的情况
-        file = ts_files[0]
-        current_size = file.stat().st_size
-        file_path_str = str(file)
+        entry = ts_entries[0]
+        st = entry.stat()
+        current_size = st.st_size
+        key = (st.st_dev, st.st_ino)
+        cached = file_cache.get(key)
         
-        if file_path_str in file_cache:
+        if cached is not None:
             # 如果文件在缓存中且大小没有变化
-            if current_size == file_cache[file_path_str]:
-                logging.info(f"文件 {file} 大小未变化，准备移动到云端")
-                if move_file_to_cloud(file):
-                    file_cache.pop(file_path_str)  # 从缓存中移除已移动的文件
+            if current_size == cached[0]:
+                logging.info(f"文件 {entry.path} 大小未变化，准备移动到云端")
+                to_move.append((directory, entry.name, target_path, st))
             else:
-                logging.info(f"文件 {file} 大小已改变，更新缓存")
-                file_cache[file_path_str] = current_size
+                logging.info(f"文件 {entry.path} 大小已改变，更新缓存")
+                file_cache[key] = (current_size, st.st_mtime)
         else:
             # 新文件，添加到缓存
-            logging.info(f"新文件 {file}，添加到缓存")
-            file_cache[file_path_str] = current_size
+            logging.info(f"新文件 {entry.path}，添加到缓存")
+            file_cache[key] = (current_size, st.st_mtime)
+
+def upload_worker(upload_queue, moved):
+    """
+    上传线程：从队列中取出文件移动到云端，取到 None 时退出
+    参数:
+        upload_queue: 待移动文件队列，元素为 (所在目录, 文件名, 云端目标路径, stat结果)
+        moved: 成功移动的文件stat结果列表，由主线程在上传结束后统一更新缓存
+    """
+    while True:
+        item = upload_queue.get()
+        try:
+            if item is None:
+                return
+            directory, name, target_path, st = item
+            # 捕获所有异常，保证线程继续消费队列，否则队列写满后扫描线程会一直阻塞
+            try:
+                success = move_file_to_cloud(directory, name, target_path, st.st_size)
+            except Exception as e:
+                logging.error(f"移动文件 {os.path.join(directory, name)} 失败: {e!r}")
+                success = False
+            if success:
+                moved.append(st)
+        finally:
+            upload_queue.task_done()
+
+def start_uploads(upload_queue, moved):
+    """
+    启动 rclone 守护进程和上传线程，扫描过程中即可开始上传
+    参数:
+        upload_queue: 待移动文件队列
+        moved: 成功移动的文件stat结果列表
+    返回: (守护进程, 上传线程列表)，守护进程启动失败时返回 None
+    """
+    daemon = start_rclone_daemon()
+    if daemon is None:
+        return None
+    
+    workers = [
+        threading.Thread(target=upload_worker, args=(upload_queue, moved), daemon=True)
+        for _ in range(CONCURRENCY)
+    ]
+    for worker in workers:
+        worker.start()
+    return daemon, workers
+
+def finish_uploads(uploads, upload_queue):
+    """
+    通知上传线程退出，等待剩余文件上传完成后停止守护进程
+    参数:
+        uploads: start_uploads 的返回值
+        upload_queue: 待移动文件队列
+    """
+    daemon, workers = uploads
+    try:
+        for _ in workers:
+            upload_queue.put(None)
+        for worker in workers:
+            worker.join()
+    finally:
+        stop_rclone_daemon(daemon)
 
 def main():
     """
     主函数：递归扫描并处理所有目录中的.ts文件
     """
-    logging.info("开始扫描目录")
-    
-    # 加载文件缓存
-    file_cache = load_file_cache()
-    
-    # 获取当前目录
-    current_dir = Path.cwd()
-    
-    # 递归遍历所有子目录
-    for directory in [current_dir] + [d for d in current_dir.rglob("*") if d.is_dir()]:
-        logging.info(f"正在检查目录: {directory}")
-        process_directory(directory, file_cache)
-    
-    # 保存更新后的缓存
-    save_file_cache(file_cache)
-    logging.info("扫描完成")
+    _log_listener.start()
+    try:
+        logging.info("开始扫描目录")
+        
+        # 加载文件缓存
+        conn = open_cache_db()
+        old_cache = load_file_cache(conn)
+        file_cache = dict(old_cache)
+        uploaded = load_file_cache(conn, "uploaded")
+        new_uploaded = {}
+        dir_cache = load_dir_cache(conn)
+        new_dir_cache = {}
+        
+        # 递归遍历所有子目录，发现需要移动的文件后立即交给上传线程，扫描与上传同时进行
+        upload_queue = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        moved = []
+        uploads = None  # 出现第一个待移动文件时才启动守护进程
+        upload_failed = False
+        dirs_seen = 0
+        ts_total = 0
+        queued_bytes = 0
+        log_dirs = logging.getLogger().isEnabledFor(logging.DEBUG)
+        try:
+            for directory, ts_entries in scan_directories(CWD, dir_cache, new_dir_cache):
+                dirs_seen += 1
+                ts_total += len(ts_entries)
+                if log_dirs:
+                    logging.debug(f"正在检查目录: {directory}")
+                to_move = []
+                process_directory(directory, ts_entries, file_cache, uploaded, new_uploaded, to_move)
+                if not to_move or upload_failed:
+                    continue
+                if uploads is None:
+                    uploads = start_uploads(upload_queue, moved)
+                    if uploads is None:
+                        upload_failed = True
+                        continue
+                for item in to_move:
+                    queued_bytes += item[3].st_size
+                    upload_queue.put(item)
+        finally:
+            if uploads is not None:
+                finish_uploads(uploads, upload_queue)
+        
+        # 上传线程已全部退出，在主线程中更新缓存
+        for st in moved:
+            key = (st.st_dev, st.st_ino)
+            file_cache.pop(key, None)  # 从缓存中移除已移动的文件
+            new_uploaded[key] = (st.st_size, st.st_mtime)
+        
+        # 保存更新后的缓存
+        save_file_cache(conn, old_cache, file_cache)
+        # 只保留本次扫描中仍存在于本地的已上传文件记录
+        save_file_cache(conn, uploaded, new_uploaded, "uploaded")
+        save_dir_cache(conn, dir_cache, new_dir_cache)
+        conn.close()
+        logging.info("扫描完成 dirs=%d ts=%d moved=%d kept=%d bytes=%d",
+                     dirs_seen, ts_total, len(moved), ts_total - len(moved), queued_bytes)
+    finally:
+        # 停止后台日志线程，确保队列中剩余的日志全部写出
+        _log_listener.stop()
 
 if __name__ == "__main__":
     main()
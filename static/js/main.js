@@ -295,22 +295,34 @@ socket.on('status', (data) => {
     }
 });
 
+// 处理单条日志并根据内容更新UI状态
+function handleLogLine(line) {
+    addLog(line);
+
+    // 如果是重启相关的消息，更新UI状态
+    if (line.includes('正在重启程序')) {
+        startBtn.disabled = true;
+        stopBtn.disabled = true;
+    } else if (line.includes('程序已重启')) {
+        startBtn.disabled = true;
+        stopBtn.disabled = false;
+    } else if (line.includes('重启失败')) {
+        startBtn.disabled = false;
+        stopBtn.disabled = true;
+    }
+}
+
 socket.on('log', (data) => {
     console.log('收到日志:', data);
     if (data && data.data) {
-        addLog(data.data);
-        
-        // 如果是重启相关的消息，更新UI状态
-        if (data.data.includes('正在重启程序')) {
-            startBtn.disabled = true;
-            stopBtn.disabled = true;
-        } else if (data.data.includes('程序已重启')) {
-            startBtn.disabled = true;
-            stopBtn.disabled = false;
-        } else if (data.data.includes('重启失败')) {
-            startBtn.disabled = false;
-            stopBtn.disabled = true;
-        }
+        handleLogLine(data.data);
+    }
+});
+
+// 批量日志，每条消息包含多行输出
+socket.on('log_batch', (msg) => {
+    if (msg && Array.isArray(msg.lines)) {
+        msg.lines.forEach(handleLogLine);
     }
 });
 